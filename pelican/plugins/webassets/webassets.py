@@ -14,6 +14,7 @@ setting. This requires the use of SITEURL in the templates::
 
 import logging
 import os
+from contextlib import nullcontext
 
 from pelican import signals
 
@@ -21,10 +22,22 @@ logger = logging.getLogger(__name__)
 
 try:
     from .vendor import webassets
-    from .vendor.webassets import Environment
-    from .vendor.webassets.ext.jinja2 import AssetsExtension
+    from .vendor.webassets import Bundle, Environment
+    from .vendor.webassets.cache import IncrementalState
+    from .vendor.webassets.exceptions import BuildError
+    from .vendor.webassets.ext.jinja2 import AssetsExtension, Jinja2Loader
+    from .vendor.webassets.filter import Filter
+    from .vendor.webassets.instrument import Profiler
+    from .vendor.webassets.utils import parallel_map
 except ImportError:
     webassets = None
+else:
+    # intermediate build results, kept across runs of `pelican --autoreload`
+    incremental_state = IncrementalState()
+    # timings of all asset environments of a run, see WEBASSETS_PROFILE
+    profiler = Profiler()
+    # the assets environment, with the settings it was created for
+    shared_env = {"key": None, "env": None}
 
 
 def add_jinja2_ext(pelican):
@@ -36,12 +49,75 @@ def add_jinja2_ext(pelican):
 
 
 def create_assets_env(generator):
-    """Define the assets environment and pass it to the generator."""
+    """Pass the assets environment of this run to the generator.
+
+    All generators share one environment, which is also kept across runs
+    of ``pelican --autoreload`` as long as the settings stay the same, so
+    that what it learned about the bundles is not thrown away.
+    """
+    key = _settings_key(generator)
+    if shared_env["key"] != key:
+        shared_env["env"] = _make_assets_env(generator)
+        shared_env["key"] = key
+    generator.env.assets_environment = shared_env["env"]
+
+    # the {% assets %} tag memoizes its urls between renders; start afresh
+    # for each generator run so changed sources are picked up
+    extension = generator.env.extensions.get(AssetsExtension.identifier)
+    if extension is not None:
+        extension.clear_render_cache()
+
+
+def _settings_key(generator):
+    """Return what the assets environment of ``generator`` depends on."""
+    settings = sorted(
+        (name, value)
+        for name, value in generator.settings.items()
+        if name.startswith(("WEBASSETS_", "ASSET_"))
+        or name in ("THEME_STATIC_DIR", "THEME_STATIC_PATHS")
+    )
+    # without a debug setting, the log level decides
+    debug = logger.getEffectiveLevel() <= logging.DEBUG
+    return _stable_value((generator.output_path, generator.theme, settings, debug))
+
+
+def _stable_value(value):
+    """Return ``value`` in a form that compares equal for equal settings.
+
+    Settings are read anew on each run of ``pelican --autoreload``, and
+    filters and bundles compare, and repr, by identity, so they are
+    replaced by what identifies them.
+    """
+    if isinstance(value, Filter):
+        return ("filter", value.id())
+    if isinstance(value, Bundle):
+        return (
+            "bundle",
+            _stable_value(value.contents),
+            value.output,
+            _stable_value(value.filters),
+            _stable_value(value.depends),
+            _stable_value(value.version),
+            value.remove_duplicates,
+            value.merge,
+            _stable_value(value.extra),
+            _stable_value(value.config._dict),
+        )
+    if isinstance(value, dict):
+        items = sorted(value.items(), key=lambda item: repr(item[0]))
+        return ("dict", tuple((repr(k), _stable_value(v)) for k, v in items))
+    if isinstance(value, (list, tuple)):
+        return tuple(_stable_value(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return ("set", tuple(sorted(repr(v) for v in value)))
+    return repr(value)
+
+
+def _make_assets_env(generator):
+    """Create the assets environment, as configured by the settings."""
     theme_static_dir = generator.settings["THEME_STATIC_DIR"]
     assets_destination = os.path.join(generator.output_path, theme_static_dir)
-    generator.env.assets_environment = Environment(
-        assets_destination, theme_static_dir or "."
-    )
+    env = Environment(assets_destination, theme_static_dir or ".")
 
     # TODO: remove deprecated variables in 2022
     for variable in [
@@ -60,19 +136,24 @@ def create_assets_env(generator):
             variable.replace("ASSET", "WEBASSETS"),
         )
 
+    # sources do not change while the site is generated, so an up to date
+    # bundle need not be checked again for each page rendered with it; each
+    # run starts by checking them anew, see prepare_assets
+    env.updater_freshness = True
+
     # use WEBASSETS_CONFIG over ASSET_CONFIG
     for key, value in generator.settings.get(
         "WEBASSETS_CONFIG", generator.settings.get("ASSET_CONFIG", [])
     ):
         logger.debug("webassets: adding config: '%s' -> '%s'", key, value)
-        generator.env.assets_environment.config[key] = value
+        env.config[key] = value
 
     # use WEBASSETS_BUNDLES over ASSET_BUNDLES
     for name, args, kwargs in generator.settings.get(
         "WEBASSETS_BUNDLES", generator.settings.get("ASSET_BUNDLES", [])
     ):
         logger.debug("webassets: registering bundle: '%s'", name)
-        generator.env.assets_environment.register(name, *args, **kwargs)
+        env.register(name, *args, **kwargs)
 
     # prefer WEBASSETS_DEBUG -> ASSET_DEBUG -> logger.level
     in_debug = generator.settings.get(
@@ -84,7 +165,20 @@ def create_assets_env(generator):
 
     if in_debug is True:
         logger.debug("webassets: running in DEBUG mode")
-    generator.env.assets_environment.debug = in_debug
+    env.debug = in_debug
+
+    if "WEBASSETS_BUILD_JOBS" in generator.settings:
+        build_jobs = generator.settings["WEBASSETS_BUILD_JOBS"]
+        logger.debug("webassets: building with %s jobs", build_jobs)
+        env.build_jobs = build_jobs
+
+    if generator.settings.get("WEBASSETS_INCREMENTAL", False):
+        env.incremental = incremental_state
+
+    if generator.settings.get("WEBASSETS_PROFILE") or generator.settings.get(
+        "WEBASSETS_TRACE"
+    ):
+        env.profile = profiler
 
     # prefer WEBASSETS_SOURCE_PATHS over ASSET_SOURCE_PATHS
     extra_paths = generator.settings.get(
@@ -94,7 +188,98 @@ def create_assets_env(generator):
     for path in generator.settings["THEME_STATIC_PATHS"] + extra_paths:
         full_path = os.path.join(generator.theme, path)
         logger.debug("webassets: using assets in '%s'", full_path)
-        generator.env.assets_environment.append_path(full_path)
+        env.append_path(full_path)
+
+    return env
+
+
+def prepare_assets(generators):
+    """Get the bundles ready, now that the pages are about to be rendered.
+
+    Sources may have changed and output files may have been deleted since
+    the last run, so the bundles are checked again. With
+    ``WEBASSETS_PREBUILD``, the bundles used in the templates are then
+    built, in parallel if ``WEBASSETS_BUILD_JOBS`` allows, so rendering
+    only has to look up their urls.
+    """
+    env = shared_env["env"]
+    if env is None or not generators:
+        return
+    if hasattr(env.updater, "invalidate"):
+        env.updater.invalidate()
+    _forget_resolved(env)
+
+    settings = generators[0].settings
+    if not settings.get("WEBASSETS_PREBUILD") or env.debug is True:
+        # in debug mode, the templates link to the source files
+        return
+
+    jinja_envs = []
+    for generator in generators:
+        jinja_env = getattr(generator, "env", None)
+        if jinja_env is not None and jinja_env not in jinja_envs:
+            jinja_envs.append(jinja_env)
+    theme = generators[0].theme
+    directories = list(settings.get("THEME_TEMPLATES_OVERRIDES", []))
+    directories.append(os.path.join(theme, "templates"))
+
+    bundles = {}
+    for extension in settings.get("TEMPLATE_EXTENSIONS", [".html"]):
+        loader = Jinja2Loader(env, directories, jinja_envs, jinja_ext="*" + extension)
+        for bundle in loader.load_bundles():
+            for output_bundle in _output_bundles(bundle):
+                bundles.setdefault(output_bundle.output, output_bundle)
+
+    def build(bundle):
+        try:
+            with bundle.bind(env):
+                bundle.build()
+        except BuildError as e:
+            logger.warning("webassets: could not prebuild '%s': %s", bundle.output, e)
+
+    manifest = env.manifest
+    with manifest.batch() if manifest else nullcontext():
+        parallel_map(build, bundles.values(), env.build_jobs)
+    logger.debug("webassets: prebuilt %d bundles", len(bundles))
+
+
+def _forget_resolved(bundles):
+    """Have ``bundles`` resolve their contents anew.
+
+    Files matching their globs may have been added or removed since the last
+    run, and their settings may have changed.
+    """
+    for bundle in bundles:
+        bundle._resolved_contents = None
+        _forget_resolved(item for item in bundle.contents if isinstance(item, Bundle))
+
+
+def _output_bundles(bundle):
+    """Yield the bundles with an output file in ``bundle``, itself included."""
+    if bundle.output:
+        yield bundle
+        return
+    for item in bundle.contents:
+        if isinstance(item, Bundle):
+            yield from _output_bundles(item)
+
+
+def flush_cache(pelican):
+    """Commit the writes the cache of the assets environment batched up."""
+    env = shared_env["env"]
+    if env is not None and env.cache:
+        env.cache.flush()
+
+
+def report_profile(pelican):
+    """Log and export the timings of the asset builds of this run."""
+    if pelican.settings.get("WEBASSETS_PROFILE"):
+        logger.info("webassets: build profile:\n%s", profiler.summary(limit=30))
+    trace = pelican.settings.get("WEBASSETS_TRACE")
+    if trace:
+        profiler.write_trace(trace)
+        logger.info("webassets: wrote trace to '%s'", trace)
+    profiler.clear()
 
 
 def register():
@@ -105,3 +290,6 @@ def register():
 
     signals.initialized.connect(add_jinja2_ext)
     signals.generator_init.connect(create_assets_env)
+    signals.all_generators_finalized.connect(prepare_assets)
+    signals.finalized.connect(flush_cache)
+    signals.finalized.connect(report_profile)
@@ -33,6 +33,17 @@ def tests(c, deprecations=False):
     c.run(f"{CMD_PREFIX}pytest {deprecations_flag}", pty=PTY)
 
 
+@task(iterable=["scale"])
+def benchmark(c, scale=None, repeat=3, output="", compare=""):
+    """Benchmark builds, optionally saving to `--output` or comparing to `--compare`."""
+    args = "".join(f" --scale {s}" for s in scale or [])
+    if output:
+        args += f" --output {output}"
+    if compare:
+        args += f" --compare {compare}"
+    c.run(f"{CMD_PREFIX}python tests/benchmark.py --repeat {repeat}{args}", pty=PTY)
+
+
 @task
 def format(c, check=False, diff=False):
     """Run Ruff's auto-formatter, optionally with `--check` or `--diff`."""
@@ -0,0 +1,388 @@
+"""Benchmark asset builds on synthetic sites of several sizes.
+
+For each scale, a theme with nested CSS and JS bundles is generated, and
+the following is measured:
+
+- ``cold_build``: building all bundles with an empty cache
+- ``warm_noop``: checking all bundles again in a fresh environment, when
+  nothing has changed (what every Pelican run without changes does)
+- ``rebuild_one``: rebuilding after a single source file changed
+- ``rebuild_one_incremental``: the same, with incremental builds enabled
+- ``render_per_page_us``: how much an ``{% assets %}`` tag adds to the
+  time it takes to render a page
+- ``context_lookup_us``: looking up the settings a build uses most, in
+  a bundle nested as deeply as the scale's ``nesting``
+- ``peak_rss_kb``: the peak memory usage of the process
+
+Each scale runs in a process of its own, so that the peak memory usage
+of one scale does not hide that of the next. Results are written as
+JSON, to compare them across commits::
+
+    python tests/benchmark.py --output before.json
+    # ... make some changes ...
+    python tests/benchmark.py --output after.json --compare before.json
+
+Or run ``invoke benchmark``.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+FORMAT_VERSION = 1
+
+# sections: bundles of each kind; files: source files per bundle;
+# pages: pages rendered with an {% assets %} tag; nesting: levels of
+# bundles for context_lookup_us
+SCALES = {
+    "small": {"sections": 2, "files": 10, "pages": 100, "nesting": 2},
+    "medium": {"sections": 5, "files": 40, "pages": 1000, "nesting": 5},
+    "large": {"sections": 10, "files": 200, "pages": 5000, "nesting": 10},
+}
+
+PHASES = (
+    "cold_build",
+    "warm_noop",
+    "rebuild_one",
+    "rebuild_one_incremental",
+    "render_per_page_us",
+    "context_lookup_us",
+    "peak_rss_kb",
+)
+
+CSS_TEMPLATE = """\
+/* section {section}, file {index} */
+.block-{index} {{
+    background: url("../../img/bg-{index}.png") no-repeat;
+    margin: {index}px auto;
+    padding: 0 {index}px;
+}}
+.block-{index} .title {{
+    font: bold 1.{index}em/1.2 sans-serif;
+    color: #{index:06d};
+}}
+"""
+
+JS_TEMPLATE = """\
+// section {section}, file {index}
+(function (window) {{
+    "use strict";
+    var counter{index} = 0;
+    function handler{index}(event) {{
+        counter{index} += 1;
+        window.console.log("clicked", counter{index}, event.target);
+    }}
+    window.document.addEventListener("click", handler{index});
+}})(window);
+"""
+
+PAGE_WITH_ASSETS = """\
+<html><head><title>{{ title }}</title>
+{% assets "css_s0", "js_s0" %}<link href="{{ ASSET_URL }}">{% endassets %}
+</head><body>{% for i in range(10) %}<p>{{ title }} {{ i }}</p>{% endfor %}
+</body></html>
+"""
+
+PAGE_WITHOUT_ASSETS = """\
+<html><head><title>{{ title }}</title>
+<link href="/theme/css/s0.css">
+</head><body>{% for i in range(10) %}<p>{{ title }} {{ i }}</p>{% endfor %}
+</body></html>
+"""
+
+
+def css_minifier():
+    """Return the name of the fastest CSS minifier filter available."""
+    for name in ("rcssmin", "cssmin"):
+        try:
+            __import__(name)
+        except ImportError:
+            continue
+        return name
+    return None
+
+
+def generate_site(root, sections, files):
+    """Write the source files of a theme, and return the bundle contents.
+
+    Each section has a CSS bundle, with its files spread over nested
+    directories, and a JS bundle.
+    """
+    static = root / "static"
+    contents = {}
+    for section in range(sections):
+        css, js = [], []
+        for index in range(files):
+            name = f"css/s{section}/part{index % 3}/f{index}.css"
+            path = static / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(CSS_TEMPLATE.format(section=section, index=index))
+            css.append(name)
+
+            name = f"js/s{section}/f{index}.js"
+            path = static / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(JS_TEMPLATE.format(section=section, index=index))
+            js.append(name)
+        contents[section] = (css, js)
+    return static, contents
+
+
+def make_env(root, static, contents, incremental=None):
+    """Return an assets environment with the bundles of the site."""
+    from pelican.plugins.webassets.vendor.webassets import Bundle, Environment
+
+    env = Environment(str(root / "output"), "/theme")
+    env.append_path(str(static), "/theme")
+    (root / "cache").mkdir(exist_ok=True)
+    env.cache = str(root / "cache")
+    env.incremental = incremental
+    minifier = css_minifier()
+    for section, (css, js) in contents.items():
+        # The CSS of a section is split into a nested bundle per directory.
+        parts = {}
+        for name in css:
+            parts.setdefault(os.path.dirname(name), []).append(name)
+        nested = [Bundle(*names, filters="cssrewrite") for names in parts.values()]
+        env.register(
+            f"css_s{section}",
+            Bundle(*nested, filters=minifier, output=f"css/s{section}.%(version)s.css"),
+        )
+        env.register(
+            f"js_s{section}",
+            Bundle(*js, filters="rjsmin", output=f"js/s{section}.%(version)s.js"),
+        )
+    return env
+
+
+def check_all(env):
+    """Ask every bundle for its urls, building those that need it."""
+    for bundle in env:
+        bundle.urls()
+
+
+def timed(func, *args):
+    """Return how many seconds ``func(*args)`` took."""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def touch(path):
+    """Change a source file, making sure its modification time moves on."""
+    stat = path.stat()
+    path.write_text(path.read_text() + "\n.changed { color: red; }\n")
+    mtime = stat.st_mtime_ns + 2 * 10**9
+    os.utime(path, ns=(mtime, mtime))
+
+
+def measure_render(env, pages):
+    """Return the time an {% assets %} tag adds to rendering a page, in µs."""
+    from pelican.plugins.webassets.vendor.webassets.ext.jinja2 import (
+        AssetsExtension,
+    )
+
+    import jinja2
+
+    jinja_env = jinja2.Environment(extensions=[AssetsExtension])
+    jinja_env.assets_environment = env
+    with_assets = jinja_env.from_string(PAGE_WITH_ASSETS)
+    without_assets = jinja_env.from_string(PAGE_WITHOUT_ASSETS)
+
+    def render(template):
+        for page in range(pages):
+            template.render(title=f"Page {page}")
+
+    overhead = timed(render, with_assets) - timed(render, without_assets)
+    return max(overhead, 0) / pages * 1e6
+
+
+def measure_context(env, nesting, repeat=2000):
+    """Return the time to look up common settings of a nested bundle, in µs.
+
+    The bundle is nested ``nesting`` levels deep; its context is made, as
+    a build does, and the settings a build uses most are read from it.
+    """
+    from pelican.plugins.webassets.vendor.webassets.bundle import Bundle, wrap
+
+    bundles = [Bundle("css/x.css")]
+    for _ in range(nesting):
+        bundles.insert(0, Bundle(bundles[0]))
+
+    def lookup():
+        for _ in range(repeat):
+            ctx = env
+            for bundle in bundles:
+                ctx = wrap(ctx, bundle)
+            for _ in range(10):
+                ctx.cache, ctx.resolver, ctx.debug  # noqa: B018
+                ctx.manifest, ctx.load_path, ctx.updater  # noqa: B018
+
+    return timed(lookup) / repeat * 1e6
+
+
+def peak_rss_kb():
+    """Return the peak memory usage of this process in KiB, if known."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_once(params):
+    """Measure all phases once, on a newly generated site."""
+    from pelican.plugins.webassets.vendor.webassets.cache import (
+        IncrementalState,
+        file_digests,
+    )
+
+    with tempfile.TemporaryDirectory(prefix="webassets-bench.") as tmp:
+        root = Path(tmp)
+        static, contents = generate_site(root, params["sections"], params["files"])
+        changed = static / contents[0][0][0]
+        result = {}
+
+        file_digests.clear()
+        env = make_env(root, static, contents)
+        result["cold_build"] = timed(check_all, env)
+
+        # A new process knows nothing but what is on disk.
+        file_digests.clear()
+        env = make_env(root, static, contents)
+        result["warm_noop"] = timed(check_all, env)
+
+        touch(changed)
+        env = make_env(root, static, contents)
+        result["rebuild_one"] = timed(check_all, env)
+
+        env = make_env(root, static, contents, incremental=IncrementalState())
+        check_all(env)
+        touch(changed)
+        result["rebuild_one_incremental"] = timed(check_all, env)
+
+        result["render_per_page_us"] = measure_render(env, params["pages"])
+        result["context_lookup_us"] = measure_context(env, params["nesting"])
+        return result
+
+
+def run_scale(scale, repeat):
+    """Measure a scale ``repeat`` times; return the best of each phase."""
+    params = SCALES[scale]
+    runs = [run_once(params) for _ in range(repeat)]
+    result = {phase: min(run[phase] for run in runs) for phase in runs[0]}
+    result["peak_rss_kb"] = peak_rss_kb()
+    result["params"] = params
+    result["source_files"] = params["sections"] * params["files"] * 2
+    result["css_minifier"] = css_minifier()
+    return result
+
+
+def run_in_subprocess(scale, repeat):
+    """Run :func:`run_scale` in a new process, and return its result."""
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", scale, "--repeat", str(repeat)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def git_commit():
+    """Return the current commit of the repository, if known."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_results(results, baseline=None):
+    """Return the results as a table, compared to ``baseline`` if given."""
+    lines = []
+    for scale, result in results["scales"].items():
+        lines.append(f"{scale} ({result['source_files']} source files)")
+        previous = (baseline or {}).get("scales", {}).get(scale, {})
+        for phase in PHASES:
+            value = result.get(phase)
+            if value is None:
+                continue
+            shown = f"{value:.4f}" if isinstance(value, float) else str(value)
+            line = f"  {phase:<26} {shown:>12}"
+            if previous.get(phase):
+                line += f"  {value / previous[phase]:>6.2f}x"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """Run the benchmarks given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scale",
+        action="append",
+        choices=sorted(SCALES),
+        help="Scale to run; may be given multiple times (default: all).",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per scale; the best counts."
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="Compare with results from this file.")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        json.dump(run_scale(args.child, args.repeat), sys.stdout)
+        return 0
+
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
+    results = {
+        "version": FORMAT_VERSION,
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scales": {},
+    }
+    for scale in args.scale or list(SCALES):
+        logger.info("Running %s...", scale)
+        results["scales"][scale] = run_in_subprocess(scale, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    logger.info("%s", format_results(results, baseline))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        logger.info("Results written to %s", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
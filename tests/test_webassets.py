@@ -2,8 +2,10 @@
 
 import hashlib
 import locale
+import logging
+import os
 from pathlib import Path
-from shutil import rmtree
+from shutil import rmtree, which
 from tempfile import mkdtemp
 import unittest
 
@@ -183,9 +185,13 @@ class DummyPlugin:
 
     __name__ = "webassets.dummy.plugin"
 
+    def __init__(self):
+        self.generators = []
+
     def article_generator_init(self, generator):
         print("called")
         self.generator = generator
+        self.generators.append(generator)
 
     def register(self):
         signals.generator_init.connect(self.article_generator_init)
@@ -309,6 +315,110 @@ class TestWebAssetsConfigSettings(TestWebAssets):
 
         self.assertIn(LibSass(), test_bundle.filters)
 
+    def test_webassets_build_jobs(self):
+        """ensure WEBASSETS_BUILD_JOBS is passed to the webassets module"""
+        generator = self.get_generators({"WEBASSETS_BUILD_JOBS": 3})
+        self.assertEqual(generator.env.assets_environment.build_jobs, 3)
+
+        generator = self.get_generators()
+        self.assertEqual(generator.env.assets_environment.build_jobs, 1)
+
+    def test_webassets_incremental(self):
+        """ensure the incremental state is shared between runs"""
+        from pelican.plugins.webassets.webassets import incremental_state
+
+        generator = self.get_generators()
+        self.assertIsNone(generator.env.assets_environment.incremental)
+
+        generator = self.get_generators({"WEBASSETS_INCREMENTAL": True})
+        self.assertIs(generator.env.assets_environment.incremental, incremental_state)
+
+    def test_webassets_profile(self):
+        """ensure WEBASSETS_PROFILE enables the shared profiler"""
+        from pelican.plugins.webassets.webassets import profiler
+
+        generator = self.get_generators()
+        self.assertFalse(generator.env.assets_environment.profile.enabled)
+
+        generator = self.get_generators({"WEBASSETS_PROFILE": True})
+        self.assertIs(generator.env.assets_environment.profile, profiler)
+
+    def test_cache_flushed(self):
+        """ensure batched cache writes are committed when pelican finishes"""
+        generator = self.get_generators({"WEBASSETS_CONFIG": [("cache", "sqlite")]})
+        cache = generator.env.assets_environment.cache
+        self.assertGreater(cache._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0], 0)
+        self.assertEqual(cache._pending, 0)
+
+    def test_shared_environment(self):
+        """ensure generators share an environment until the settings change"""
+        from pelican.plugins import webassets
+
+        test_plugin = DummyPlugin()
+        super().setUp({"PLUGINS": [webassets, test_plugin]})
+        envs = {id(g.env.assets_environment) for g in test_plugin.generators}
+        self.assertEqual(len(envs), 1)
+        env = test_plugin.generator.env.assets_environment
+
+        # another run, as with --autoreload
+        mute(True)(Pelican(settings=self.settings).run)()
+        self.assertIs(test_plugin.generator.env.assets_environment, env)
+
+        self.settings["WEBASSETS_DEBUG"] = True
+        mute(True)(Pelican(settings=self.settings).run)()
+        self.assertIsNot(test_plugin.generator.env.assets_environment, env)
+
+    def test_settings_key(self):
+        """ensure filters and bundles in the settings do not prevent reuse"""
+        from pelican.plugins.webassets.vendor.webassets import Bundle
+        from pelican.plugins.webassets.vendor.webassets.filter import get_filter
+        from pelican.plugins.webassets.webassets import shared_env
+
+        def bundles(contents="a.css"):
+            # filters and bundles are new objects on each run
+            bundle = Bundle(contents, filters=get_filter("cssrewrite"), output="b.css")
+            return [("b", (bundle,), {})]
+
+        generator = self.get_generators({"WEBASSETS_BUNDLES": bundles()})
+        env = generator.env.assets_environment
+
+        self.settings["WEBASSETS_BUNDLES"] = bundles()
+        mute(True)(Pelican(settings=self.settings).run)()
+        self.assertIs(shared_env["env"], env)
+
+        self.settings["WEBASSETS_BUNDLES"] = bundles("other.css")
+        mute(True)(Pelican(settings=self.settings).run)()
+        self.assertIsNot(shared_env["env"], env)
+
+    def test_resolved_contents_forgotten(self):
+        """ensure a reused environment resolves its bundles again"""
+        from pelican.plugins.webassets.vendor.webassets import Bundle
+        from pelican.plugins.webassets.webassets import prepare_assets
+
+        generator = self.get_generators()
+        env = generator.env.assets_environment
+        nested = Bundle("a.css")
+        env.register("b", Bundle(nested, output="b.css"))
+        env["b"]._resolved_contents = nested._resolved_contents = ["stale"]
+        prepare_assets([generator])
+        self.assertIsNone(env["b"]._resolved_contents)
+        self.assertIsNone(nested._resolved_contents)
+
+    def test_webassets_prebuild(self):
+        """ensure WEBASSETS_PREBUILD builds the bundles of the templates"""
+        from pelican.plugins.webassets.webassets import prepare_assets
+
+        generator = self.get_generators({"WEBASSETS_DEBUG": False})
+        output = Path(self.temp_path) / "theme" / "{}.min.css".format(CSS_HASH)
+        output.unlink()
+
+        prepare_assets([generator])
+        self.assertFalse(output.exists())
+
+        generator.settings["WEBASSETS_PREBUILD"] = True
+        prepare_assets([generator])
+        self.assertTrue(output.is_file())
+
     def test_webassets_source_paths(self):
         """ensure WEBASSETS_SOURCE_PATHS is passed to the webassets module"""
         source_paths = ["some", "random", "source", "paths/for/webassets"]
@@ -380,6 +490,1666 @@ class TestWebAssetsThemeStaticDir(TestWebAssets):
         )
 
 
+class VendorTestCase(unittest.TestCase):
+    """Base class for testing the vendored webassets package directly."""
+
+    default_files = {}
+
+    def setUp(self):
+        from pelican.plugins.webassets.vendor.webassets.test import (
+            TempEnvironmentHelper,
+        )
+
+        self.helper = TempEnvironmentHelper()
+        self.helper.default_files = self.default_files
+        self.helper.setup_method()
+        self.env = self.helper.env
+
+    def tearDown(self):
+        self.helper.teardown_method()
+
+    def mkbundle(self, *args, **kwargs):
+        return self.helper.mkbundle(*args, **kwargs)
+
+
+class TestAssetsTagRenderCache(VendorTestCase):
+    """the {% assets %} tag should only resolve its bundle once"""
+
+    default_files = {"in1.css": "A", "in2.css": "B"}
+
+    def setUp(self):
+        super().setUp()
+        import jinja2
+
+        from pelican.plugins.webassets.vendor.webassets.ext.jinja2 import (
+            AssetsExtension,
+        )
+
+        created = self.created = []
+
+        class CountingBundle(AssetsExtension.BundleClass):
+            def __init__(self, *args, **kwargs):
+                created.append(self)
+                super().__init__(*args, **kwargs)
+
+        self.jinja_env = jinja2.Environment(extensions=[AssetsExtension])
+        self.jinja_env.assets_environment = self.env
+        self.extension = self.jinja_env.extensions[AssetsExtension.identifier]
+        self.extension.BundleClass = CountingBundle
+        self.template = self.jinja_env.from_string(
+            '{% assets output="out.css", "in1.css", "in2.css" %}'
+            "{{ ASSET_URL }};{% endassets %}"
+        )
+
+    def test_memoized(self):
+        first = self.template.render()
+        self.assertEqual(first, self.template.render())
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(self.helper.get("out.css"), "A\nB")
+
+    def test_clear_render_cache(self):
+        self.template.render()
+        self.extension.clear_render_cache()
+        self.template.render()
+        self.assertEqual(len(self.created), 2)
+
+    def test_environment_is_part_of_key(self):
+        from pelican.plugins.webassets.vendor.webassets import Environment
+
+        self.template.render()
+        self.jinja_env.assets_environment = Environment(self.helper.tempdir, "/other")
+        self.assertIn("/other/out.css", self.template.render())
+        self.assertEqual(len(self.created), 2)
+
+
+class TestParallelBuild(VendorTestCase):
+    """bundles and their source files can be processed by a worker pool"""
+
+    default_files = {"in%d" % i: "content %d" % i for i in range(8)}
+
+    def input_filter(self):
+        import threading
+        import time
+
+        from pelican.plugins.webassets.vendor.webassets.filter import Filter
+
+        threads = self.threads = set()
+
+        class SlowFilter(Filter):
+            name = "slow"
+
+            def input(self, _in, out, **kw):
+                threads.add(threading.get_ident())
+                time.sleep(0.05)
+                out.write(_in.read().upper())
+
+        return SlowFilter()
+
+    def test_build_jobs_option(self):
+        self.assertEqual(self.env.build_jobs, 1)
+        self.env.build_jobs = True
+        self.assertGreaterEqual(self.env.build_jobs, 1)
+        self.env.build_jobs = "4"
+        self.assertEqual(self.env.build_jobs, 4)
+
+    def test_input_filters_fan_out(self):
+        self.env.build_jobs = 4
+        files = sorted(self.default_files)
+        self.mkbundle(*files, filters=self.input_filter(), output="out").build()
+        self.assertEqual(
+            self.helper.get("out"),
+            "\n".join(self.default_files[f].upper() for f in files),
+        )
+        self.assertGreater(len(self.threads), 1)
+
+    def test_serial_by_default(self):
+        self.mkbundle("in1", "in2", filters=self.input_filter(), output="out").build()
+        self.assertEqual(self.helper.get("out"), "CONTENT 1\nCONTENT 2")
+        self.assertEqual(len(self.threads), 1)
+
+    def test_build_command_jobs(self):
+        import logging
+
+        from pelican.plugins.webassets.vendor.webassets.script import (
+            CommandLineEnvironment,
+        )
+
+        for i in range(4):
+            self.env.register(
+                "b%d" % i,
+                "in%d" % i,
+                "in%d" % (i + 4),
+                filters=self.input_filter(),
+                output="out%d" % i,
+            )
+        cmd = CommandLineEnvironment(self.env, logging.getLogger("test"))
+        self.assertIsNone(cmd.build(jobs=4))
+        # the setting is only changed for this build
+        self.assertEqual(self.env.build_jobs, 1)
+        for i in range(4):
+            self.assertEqual(
+                self.helper.get("out%d" % i),
+                "CONTENT %d\nCONTENT %d" % (i, i + 4),
+            )
+
+    def test_nested_maps_run_serially(self):
+        import threading
+
+        from pelican.plugins.webassets.vendor.webassets.utils import parallel_map
+
+        def inner(outer_item):
+            return parallel_map(lambda item: threading.get_ident(), range(4), 4)
+
+        for idents in parallel_map(inner, range(4), 4):
+            self.assertEqual(len(set(idents)), 1)
+        nested = parallel_map(
+            lambda _: parallel_map(lambda i: i * 2, range(3), 2, nested=True), range(2), 2
+        )
+        self.assertEqual(nested, [[0, 2, 4], [0, 2, 4]])
+
+
+class TestFileDigestIndex(VendorTestCase):
+    """source files are only read when their stat() signature changes"""
+
+    default_files = {"in1": "A", "in2": "B"}
+
+    def setUp(self):
+        super().setUp()
+        from pelican.plugins.webassets.vendor.webassets.cache import FileDigestIndex
+
+        self.index = FileDigestIndex()
+        # files modified just now are not remembered, see test_racy
+        for name in self.default_files:
+            mtime = os.stat(self.helper.path(name)).st_mtime - 10
+            os.utime(self.helper.path(name), (mtime, mtime))
+
+    def test_racy(self):
+        self.helper.create_files({"in1": "X"})
+        self.index.digest(self.helper.path("in1"))
+        self.assertEqual(self.index.stats()["entries"], 0)
+        # a write of the same size within the same tick is noticed
+        self.helper.create_files({"in1": "Y"})
+        self.assertEqual(self.index.digest(self.helper.path("in1")), hashlib.md5(b"Y").hexdigest())
+
+    def test_hits_and_misses(self):
+        digest = self.index.digest(self.helper.path("in1"))
+        self.assertEqual(digest, hashlib.md5(b"A").hexdigest())
+        self.assertEqual(self.index.digest(self.helper.path("in1")), digest)
+        self.assertEqual(self.index.stats()["hits"], 1)
+        self.assertEqual(self.index.stats()["misses"], 1)
+
+        self.helper.create_files({"in1": "AA"})
+        self.assertEqual(
+            self.index.digest(self.helper.path("in1")),
+            hashlib.md5(b"AA").hexdigest(),
+        )
+        self.assertEqual(self.index.stats()["misses"], 2)
+
+    def test_persistence(self):
+        from pelican.plugins.webassets.vendor.webassets.cache import FileDigestIndex
+
+        filename = self.helper.path("digests")
+        self.index.persist_to(filename)
+        self.index.digest(self.helper.path("in1"))
+        self.index.save()
+
+        other = FileDigestIndex()
+        other.persist_to(filename)
+        other.digest(self.helper.path("in1"))
+        self.assertEqual(other.stats(), {"hits": 1, "misses": 0, "entries": 1})
+
+    def test_file_hunk_id(self):
+        from pelican.plugins.webassets.vendor.webassets.cache import make_md5
+        from pelican.plugins.webassets.vendor.webassets.merge import FileHunk
+
+        hunk = FileHunk(self.helper.path("in2"))
+        self.assertEqual(hunk.id(), hashlib.md5(b"B").hexdigest())
+        self.assertEqual(make_md5(hunk), make_md5(FileHunk(self.helper.path("in2"))))
+        self.assertNotEqual(make_md5(hunk), make_md5(FileHunk(self.helper.path("in1"))))
+
+    def test_file_hunk_id_line_endings(self):
+        from pelican.plugins.webassets.vendor.webassets import merge
+        from pelican.plugins.webassets.vendor.webassets.merge import FileHunk, MemoryHunk
+
+        # \r\n split across reads must not count as two line endings
+        content = b"xx" + b"a\r\n" * (merge.CHUNK_SIZE // 3) + b"b\rc"
+        with open(self.helper.path("crlf"), "wb") as f:
+            f.write(content)
+        hunk = FileHunk(self.helper.path("crlf"))
+        self.assertEqual(hunk.id(), MemoryHunk(hunk.data()).id())
+        self.assertEqual(hunk, MemoryHunk(hunk.data()))
+
+    def test_environment_option(self):
+        from pelican.plugins.webassets.vendor.webassets.cache import file_digests
+
+        self.assertIs(self.env.digest_cache, file_digests)
+
+    def test_loaded_by_build(self):
+        from unittest import mock
+
+        from pelican.plugins.webassets.vendor.webassets import cache
+
+        self.env.digest_cache = "digests"
+        with mock.patch.object(cache, "get_digest_cache") as get_digest_cache:
+            self.mkbundle("in1", output="out").build()
+        get_digest_cache.assert_called_once()
+        self.assertEqual(get_digest_cache.call_args[0][0], "digests")
+
+
+class TestMemoryCache(VendorTestCase):
+    """the memory cache is a bounded LRU cache"""
+
+    def test_lru(self):
+        from pelican.plugins.webassets.vendor.webassets.cache import MemoryCache
+
+        cache = MemoryCache(2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        self.assertEqual(cache.get("a"), "1")  # "b" is now least recently used
+        cache.set("c", "3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1")
+        self.assertEqual(cache.get("c"), "3")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (3, 1))
+        self.assertEqual((stats["evictions"], stats["entries"]), (1, 2))
+
+    def test_max_size(self):
+        from pelican.plugins.webassets.vendor.webassets.cache import MemoryCache
+
+        cache = MemoryCache(100, max_size=10)
+        cache.set("a", "x" * 4)
+        cache.set("b", "x" * 4)
+        cache.set("a", "x" * 2)  # replacing a value adjusts the size
+        self.assertEqual(cache.stats()["size"], 6)
+        cache.set("c", "x" * 6)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["size"], 8)
+        cache.set("d", "x" * 11)  # never fits
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(cache.get("c"), "x" * 6)
+
+    def test_get_cache(self):
+        from pelican.plugins.webassets.vendor.webassets.cache import MemoryCache
+
+        self.env.cache = "memory:5"
+        self.env.cache_max_size = 1000
+        cache = self.env.cache
+        self.assertIsInstance(cache, MemoryCache)
+        self.assertEqual((cache.capacity, cache.max_size), (5, 1000))
+        self.assertIs(self.env.cache, cache)
+
+    def test_build_with_memory_cache(self):
+        self.env.cache = "memory"
+        self.helper.create_files({"in1": "A", "in2": "B"})
+        calls = []
+
+        def count(_in, out):
+            calls.append(1)
+            out.write(_in.read())
+
+        bundle = self.mkbundle("in1", "in2", filters=count, output="out")
+        bundle.build(force=True)
+        bundle.build(force=True)
+        self.assertEqual(self.helper.get("out"), "A\nB")
+        self.assertEqual(len(calls), 1)
+        self.assertGreater(self.env.cache.stats()["hits"], 0)
+
+
+class TestSQLiteCache(VendorTestCase):
+    """the sqlite cache keeps all entries in a single database file"""
+
+    def make_cache(self, **kwargs):
+        from pelican.plugins.webassets.vendor.webassets.cache import SQLiteCache
+
+        return SQLiteCache(str(Path(self.helper.tempdir, "cache.db")), **kwargs)
+
+    def test_get_set(self):
+        cache = self.make_cache(compress="zlib")
+        cache.set(("key", 1), "x" * 1000)
+        self.assertEqual(cache.get(("key", 1)), "x" * 1000)
+        self.assertIsNone(cache.get(("key", 2)))
+        cache.flush()
+
+        # a new connection sees the committed, compressed entry
+        self.assertEqual(self.make_cache().get(("key", 1)), "x" * 1000)
+        size = cache._db.execute("SELECT size FROM cache").fetchone()[0]
+        self.assertLess(size, 100)
+
+    def test_none_and_corrupted(self):
+        import warnings
+
+        cache = self.make_cache()
+        cache.set("none", None)
+        cache.set("bad", "x")
+        cache._db.execute("UPDATE cache SET value = ? WHERE value != ?", (b"-junk", cache._encode(None)))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            self.assertIsNone(cache.get("none"))
+            self.assertEqual(caught, [])
+            self.assertIsNone(cache.get("bad"))
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(cache._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0], 1)
+
+    def test_eviction(self):
+        cache = self.make_cache(max_size=250)
+        for key in "abc":
+            cache.set(key, "x" * 100)
+        cache.get("a")  # "b" is now least recently used
+        cache.flush()
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "x" * 100)
+
+        cache.max_age = -1
+        cache.flush()
+        self.assertIsNone(cache.get("a"))
+
+    def test_get_cache(self):
+        from pelican.plugins.webassets.vendor.webassets.cache import SQLiteCache
+
+        self.env.cache = "sqlite"
+        self.env.cache_compress = True
+        self.env.cache_max_age = "3600"
+        cache = self.env.cache
+        self.assertIsInstance(cache, SQLiteCache)
+        self.assertEqual(
+            cache.filename, str(Path(self.env.directory, ".webassets-cache.db"))
+        )
+        self.assertEqual((cache.compress, cache.max_age), ("zlib", 3600.0))
+        self.assertIs(self.env.cache, cache)
+
+    def test_commit_bounds(self):
+        import gc
+
+        from pelican.plugins.webassets.vendor.webassets import cache as cache_module
+
+        cache = self.make_cache()
+        cache.batch_seconds = 0
+        cache.set("a", 1)
+        # committed right away, so another connection may write
+        other = self.make_cache()
+        self.assertEqual(other.get("a"), 1)
+        other.set("b", 2)
+        other.flush()
+
+        # a freed cache commits what is pending, and is not kept alive
+        cache = self.make_cache()
+        cache.set("c", 3)
+        del cache
+        gc.collect()
+        self.assertEqual(other.get("c"), 3)
+        self.assertEqual(
+            [c for c in cache_module._sqlite_caches if c.filename == other.filename],
+            [other],
+        )
+
+
+class TestDependsCacheKey(VendorTestCase):
+    """bundles with dependencies use the cache until a dependency changes"""
+
+    default_files = {"in": "A", "dep": "1"}
+
+    def test_depends_in_cache_key(self):
+        self.env.cache = "memory"
+        calls = []
+        dep = self.helper.path("dep")
+
+        def include(_in, out, **kw):
+            calls.append(1)
+            with open(dep) as f:
+                out.write(_in.read() + f.read())
+
+        include.input = include
+
+        def build():
+            bundle = self.mkbundle("in", filters=include, output="out", depends="dep")
+            bundle.build(force=True)
+            return self.helper.get("out")
+
+        self.assertEqual(build(), "A1")
+        self.assertEqual(build(), "A1")
+        self.assertEqual(len(calls), 1)
+
+        self.helper.create_files({"dep": "22"})
+        self.assertEqual(build(), "A22")
+        self.assertEqual(len(calls), 2)
+
+
+class TestDiscoveredDepends(VendorTestCase):
+    """filters report the files imported by the sources"""
+
+    default_files = {
+        "main.scss": '@import "partials/colors";\n@use "sass:math";\nbody {}',
+        "partials/_colors.scss": "// @import 'ignored';\n@import 'base.css', 'mixins';",
+        "partials/_mixins.scss": "",
+        "partials/unused.scss": "",
+    }
+
+    def test_find_imports(self):
+        from pelican.plugins.webassets.vendor.webassets.filter._dependencies import (
+            find_imports,
+        )
+
+        self.assertEqual(
+            find_imports(self.helper.path("main.scss")),
+            [
+                self.helper.path("partials/_colors.scss"),
+                self.helper.path("partials/_mixins.scss"),
+            ],
+        )
+
+    def test_bundle_depends(self):
+        from pelican.plugins.webassets.vendor.webassets.bundle import (
+            get_all_bundle_files,
+        )
+        from pelican.plugins.webassets.vendor.webassets.filter import Filter
+        from pelican.plugins.webassets.vendor.webassets.filter._dependencies import (
+            find_imports,
+        )
+
+        class ImportingFilter(Filter):
+            def input(self, _in, out, **kw):
+                out.write(_in.read())
+
+            def find_dependencies(self, source_path, **kw):
+                return find_imports(source_path)
+
+        self.env.cache = "memory"
+        self.env.updater = "timestamp"
+        bundle = self.mkbundle("main.scss", filters=ImportingFilter(), output="out")
+        bundle.build()
+        mixins = self.helper.path("partials/_mixins.scss")
+        self.assertIn(mixins, bundle.get_discovered_depends(self.env))
+        self.assertIn(mixins, get_all_bundle_files(bundle))
+        self.assertFalse(self.env.updater.needs_rebuild(bundle, self.env))
+
+        # a new bundle instance gets the dependencies from the cache
+        bundle = self.mkbundle("main.scss", filters=ImportingFilter(), output="out")
+        self.assertIn(mixins, bundle.get_discovered_depends(self.env))
+        mtime = os.path.getmtime(self.helper.path("out")) + 10
+        os.utime(mixins, (mtime, mtime))
+        self.assertTrue(self.env.updater.needs_rebuild(bundle, self.env))
+
+    def test_scan_cached(self):
+        from unittest import mock
+
+        from pelican.plugins.webassets.vendor.webassets.bundle import find_dependencies
+        from pelican.plugins.webassets.vendor.webassets.cache import MemoryCache
+        from pelican.plugins.webassets.vendor.webassets.filter import Filter
+        from pelican.plugins.webassets.vendor.webassets.filter._dependencies import (
+            find_imports,
+        )
+
+        scanned = []
+
+        class ImportingFilter(Filter):
+            def find_dependencies(self, source_path, **kw):
+                scanned.append(source_path)
+                return find_imports(source_path)
+
+        cache = MemoryCache()
+        main = self.helper.path("main.scss")
+        found = find_dependencies(ImportingFilter(), main, cache)
+        self.assertEqual(find_dependencies(ImportingFilter(), main, cache), found)
+        self.assertEqual(len(scanned), 1)
+
+        # a changed partial may import other files now
+        self.helper.create_files({"partials/_mixins.scss": "@import 'unused';"})
+        found = find_dependencies(ImportingFilter(), main, cache)
+        self.assertIn(self.helper.path("partials/unused.scss"), found)
+        self.assertEqual(len(scanned), 2)
+
+        # filters without imports are not looked up at all
+        with mock.patch.object(cache, "get") as get:
+            self.assertEqual(find_dependencies(Filter(), main, cache), set())
+        get.assert_not_called()
+
+
+class TestIncrementalBuild(VendorTestCase):
+    """incremental builds only process what has changed"""
+
+    default_files = {"in1": "A", "in2": "B", "in3": "C"}
+
+    def test_incremental(self):
+        from pelican.plugins.webassets.vendor.webassets.filter import Filter
+
+        self.env.cache = False
+        self.env.incremental = True
+        inputs, outputs = [], []
+
+        class Recorder(Filter):
+            name = "recorder"
+
+            def input(self, _in, out, source_path, **kw):
+                inputs.append(os.path.basename(source_path))
+                out.write(_in.read().lower())
+
+            def output(self, _in, out, **kw):
+                outputs.append(1)
+                out.write(_in.read())
+
+        # always build, without forcing it
+        self.env.updater = False
+
+        def build(**kwargs):
+            bundle = self.mkbundle("in1", "in2", "in3", filters=Recorder(), output="out")
+            bundle.build(**kwargs)
+            return self.helper.get("out")
+
+        self.assertEqual(build(), "a\nb\nc")
+        self.assertEqual((sorted(inputs), len(outputs)), (["in1", "in2", "in3"], 1))
+
+        self.helper.create_files({"in2": "XX"})
+        self.assertEqual(build(), "a\nxx\nc")
+        self.assertEqual((inputs[3:], len(outputs)), (["in2"], 2))
+
+        # the input changed, but the merged content did not
+        self.helper.create_files({"in2": "xx"})
+        self.assertEqual(build(), "a\nxx\nc")
+        self.assertEqual((inputs[4:], len(outputs)), (["in2"], 2))
+
+        # a forced build runs the output filters again
+        self.assertEqual(build(force=True), "a\nxx\nc")
+        self.assertEqual((inputs[5:], len(outputs)), ([], 3))
+
+        # without the cache, nothing is reused
+        self.assertEqual(build(disable_cache=True), "a\nxx\nc")
+        self.assertEqual((sorted(inputs[5:]), len(outputs)), (["in1", "in2", "in3"], 4))
+
+
+class TestWatch(VendorTestCase):
+    """the watch command maps changes to bundles without scanning"""
+
+    default_files = {"in1": "A", "in2": "B"}
+
+    def check_watcher(self, watcher):
+        filename = os.path.abspath(self.helper.path("in1"))
+        watcher.watch([filename])
+        self.assertEqual(watcher.wait(0), set())
+        self.helper.create_files({"in1": "AA"})
+        self.assertIn(filename, watcher.wait(1))
+        watcher.close()
+
+    def test_polling_watcher(self):
+        from pelican.plugins.webassets.vendor.webassets.script import PollingWatcher
+
+        self.check_watcher(PollingWatcher(interval=0))
+
+    def test_polling_prunes_unchanged_directories(self):
+        from unittest import mock
+
+        from pelican.plugins.webassets.vendor.webassets.script import PollingWatcher
+
+        files = [os.path.abspath(self.helper.path(name)) for name in ("in1", "in2")]
+        directory = os.path.dirname(files[0])
+        watcher = PollingWatcher(interval=1, file_interval=2)
+        watcher.watch(files)
+
+        def poll():
+            checked = []
+            signature = watcher._signature
+            watcher._last_scan = 0
+            with mock.patch.object(
+                watcher, "_signature", side_effect=lambda p: checked.append(p) or signature(p)
+            ), mock.patch("time.sleep"):
+                changed = watcher.wait(0)
+            return changed, checked
+
+        # each poll checks the directory, and every file once per file_interval
+        self.assertEqual(poll(), (set(), [directory, files[0]]))
+        self.assertEqual(poll(), (set(), [directory, files[1]]))
+
+        # when the directory changes, all its files are checked right away
+        self.helper.create_files({"in1": "AA"})
+        os.utime(directory, ns=(1, 1))
+        changed, checked = poll()
+        self.assertEqual(changed, {directory, files[0]})
+        self.assertEqual(checked[:3], [directory] + files)
+
+    def test_inotify_watcher(self):
+        from pelican.plugins.webassets.vendor.webassets.script import InotifyWatcher
+
+        if not InotifyWatcher.available():
+            self.skipTest("inotify is not available")
+        self.check_watcher(InotifyWatcher())
+
+    def test_wait_for_changes(self):
+        from pelican.plugins.webassets.vendor.webassets.script import (
+            CommandLineEnvironment,
+            PollingWatcher,
+        )
+
+        bundle1 = self.mkbundle("in1", output="out1")
+        bundle2 = self.mkbundle("in*", output="out2")
+        self.env.register("b1", bundle1)
+        self.env.register("b2", bundle2)
+        command = CommandLineEnvironment(self.env, None).commands["watch"]
+        watcher = PollingWatcher(interval=0)
+        index = command.build_index()
+        watcher.watch(index)
+
+        self.helper.create_files({"in2": "BB"})
+        self.assertEqual(command.wait_for_changes(watcher, index, 0), {bundle2})
+
+        # a new file matching a glob is picked up
+        self.helper.create_files({"in3": "C"})
+        self.assertEqual(command.wait_for_changes(watcher, index, 0), {bundle2})
+        self.assertIn(os.path.abspath(self.helper.path("in3")), index)
+        self.assertEqual(command.wait_for_changes(watcher, index, 0), set())
+
+    def test_index_updated_incrementally(self):
+        from unittest import mock
+
+        from pelican.plugins.webassets.vendor.webassets.script import (
+            CommandLineEnvironment,
+            PollingWatcher,
+        )
+
+        bundle1 = self.mkbundle("in1", output="out1")
+        bundle2 = self.mkbundle("in2", output="out2")
+        self.env.register("b1", bundle1)
+        self.env.register("b2", bundle2)
+        command = CommandLineEnvironment(self.env, None).commands["watch"]
+        watcher = PollingWatcher(interval=0)
+        index = command.build_index()
+        watcher.watch(index)
+
+        self.helper.create_files({"in2": "BB"})
+        with mock.patch.object(
+            command, "yield_bundle_files", wraps=command.yield_bundle_files
+        ) as resolve:
+            self.assertEqual(command.wait_for_changes(watcher, index, 0), {bundle2})
+        resolve.assert_called_once_with([bundle2])
+        self.assertEqual(index, command.build_index())
+
+        # new files only refresh the bundles whose globs could match them
+        bundle3 = self.mkbundle("*.css", output="out3")
+        self.env.register("b3", bundle3)
+        index = command.build_index()
+        watcher.watch(index)
+        for name, expected in (("notes.txt", []), ("new.css", [bundle3])):
+            self.helper.create_files({name: "x"})
+            os.utime(self.helper.tempdir, ns=(len(name), len(name)))
+            with mock.patch.object(
+                command, "yield_bundle_files", wraps=command.yield_bundle_files
+            ) as resolve:
+                self.assertEqual(command.wait_for_changes(watcher, index, 0), set(expected))
+            resolve.assert_called_once_with(expected)
+
+
+class TestStreaming(VendorTestCase):
+    """hunks are merged, filtered and saved piece by piece"""
+
+    default_files = {
+        "css/a.css": "a { background: url(img.png) }\nb { background: url(\n img.png) }",
+        "css/b.css": "c { color: red }",
+    }
+
+    def test_merged_hunk(self):
+        from pelican.plugins.webassets.vendor.webassets.merge import (
+            ChunkReader,
+            FileHunk,
+            MemoryHunk,
+            merge,
+        )
+
+        hunks = [FileHunk(self.helper.path("css/b.css")), MemoryHunk("x\ny")]
+        merged = merge(hunks)
+        self.assertEqual(merged.data(), "c { color: red }\nx\ny")
+        self.assertEqual(merged.id(), MemoryHunk(merged.data()).id())
+        merged.save(self.helper.path("merged"))
+        self.assertEqual(self.helper.get("merged"), merged.data())
+
+        reader = ChunkReader(merged)
+        self.assertEqual(reader.read(3), "c {")
+        self.assertEqual(list(reader), [" color: red }\n", "x\n", "y"])
+
+    def test_line_endings_across_chunks(self):
+        from unittest import mock
+
+        from pelican.plugins.webassets.vendor.webassets import merge
+
+        hunk = merge.FileHunk(self.helper.path("crlf"))
+        with mock.patch.object(merge, "CHUNK_SIZE", 4):
+            for data in (b"abc\r\r\nxyz\r\n", b"abc\r", b"ab\r\n\r\r\r\nx", b"\r\r\r\r"):
+                with open(self.helper.path("crlf"), "wb") as f:
+                    f.write(data)
+                self.assertEqual(b"".join(hunk.byte_chunks()).decode(), hunk.data())
+
+    def test_merged_hunk_read_once(self):
+        from unittest import mock
+
+        from pelican.plugins.webassets.vendor.webassets.merge import FileHunk, merge
+
+        source = FileHunk(self.helper.path("css/b.css"))
+        merged = merge([source, source])
+        with mock.patch.object(source, "byte_chunks", wraps=source.byte_chunks) as read:
+            digest = merged.id()
+            # later changes to the source do not affect the merged content
+            self.helper.create_files({"css/b.css": "changed"})
+            merged.save(self.helper.path("merged"))
+            self.assertEqual(merged.data(), "c { color: red }\nc { color: red }")
+        self.assertEqual(read.call_count, 2)
+        self.assertEqual(hashlib.md5(self.helper.get("merged").encode()).hexdigest(), digest)
+
+    def test_streaming_filter(self):
+        self.env.cache = False
+        bundle = self.mkbundle("css/a.css", "css/b.css", filters="cssrewrite", output="out/x.css")
+        bundle.build()
+        self.assertEqual(
+            self.helper.get("out/x.css"),
+            "a { background: url(../css/img.png) }\n"
+            "b { background: url(\n ../css/img.png) }\n"
+            "c { color: red }",
+        )
+
+
+class TestFusedUrlRewriting(VendorTestCase):
+    """url rewriting filters share a single scan and remember their results"""
+
+    default_files = {
+        "css/a.css": "a { background: url(img.png) }\nb { background: url('big.png') }",
+        "css/img.png": "small",
+        "css/big.png": "x" * 100,
+    }
+
+    def test_fused(self):
+        from unittest import mock
+
+        from pelican.plugins.webassets.vendor.webassets.filter import get_filter
+        from pelican.plugins.webassets.vendor.webassets.filter import (
+            cssrewrite,
+            datauri,
+        )
+        from pelican.plugins.webassets.vendor.webassets.filter.cssrewrite.base import (
+            FusedUrlRewriter,
+        )
+        from pelican.plugins.webassets.vendor.webassets.merge import fuse_filters
+
+        filters = [get_filter("datauri", max_size=10), get_filter("cssrewrite")]
+        fused = fuse_filters(filters, "input")
+        self.assertEqual(len(fused), 1)
+        self.assertIsInstance(fused[0], FusedUrlRewriter)
+        self.assertEqual(fused[0].name, "datauri+cssrewrite")
+        self.assertEqual(len(fuse_filters(filters, "output")), 2)
+
+        self.env.cache = False
+        datauri._encoded.clear()
+        cssrewrite._resolved.clear()
+        self.mkbundle("css/a.css", filters=filters, output="out/x.css").build()
+        self.assertEqual(
+            self.helper.get("out/x.css"),
+            "a { background: url(data:image/png;base64,c21hbGw=) }\n"
+            "b { background: url('../css/big.png') }",
+        )
+
+        # a second build reads and resolves nothing again
+        with mock.patch.object(datauri, "open", create=True) as opened, \
+                mock.patch.object(cssrewrite.urlpath, "relpath") as relpath:
+            self.mkbundle("css/a.css", filters=filters, output="out/x.css").build(force=True)
+        self.assertFalse(opened.called)
+        self.assertFalse(relpath.called)
+
+        # a changed file is encoded again
+        self.helper.create_files({"css/img.png": "other"})
+        os.utime(self.helper.path("css/img.png"), ns=(1, 1))
+        self.mkbundle("css/a.css", filters=filters, output="out/y.css").build()
+        self.assertIn("b3RoZXI=", self.helper.get("out/y.css"))
+
+
+class TestBytesHunks(VendorTestCase):
+    """content is only decoded when a filter needs text"""
+
+    default_files = {"a.js": "var a = 1;", "b.js": "var b = 2;"}
+
+    def test_file_hunk(self):
+        from unittest import mock
+
+        from pelican.plugins.webassets.vendor.webassets import merge
+
+        with open(self.helper.path("crlf"), "wb") as f:
+            f.write("é\r\nb\rc\r\n".encode())
+        hunk = merge.FileHunk(self.helper.path("crlf"))
+        self.assertEqual(hunk.data(), "é\nb\nc\n")
+        self.assertEqual(hunk.bytes_data(), hunk.data().encode())
+        # a \r\n split between two chunks is still one line ending
+        with mock.patch.object(merge, "CHUNK_SIZE", 3):
+            self.assertEqual(b"".join(hunk.byte_chunks()), hunk.bytes_data())
+
+        memory = merge.MemoryHunk(hunk.bytes_data())
+        self.assertEqual(memory.data(), hunk.data())
+        self.assertEqual(memory.id(), merge.MemoryHunk(hunk.data()).id())
+
+    def test_bytes_filters(self):
+        from unittest import mock
+
+        from pelican.plugins.webassets.vendor.webassets.filter import Filter
+        from pelican.plugins.webassets.vendor.webassets.merge import FileHunk
+
+        received = []
+
+        class Upper(Filter):
+            supports_bytes = True
+
+            def output(self, _in, out, **kw):
+                data = _in.read()
+                received.append(type(data))
+                out.write(data.upper())
+
+        class Reverse(Filter):
+            def output(self, _in, out, **kw):
+                data = _in.read()
+                received.append(type(data))
+                out.write(data[::-1])
+
+        self.env.cache = False
+        bundle = self.mkbundle("a.js", "b.js", filters=[Upper()], output="out")
+        # the source files are never decoded
+        with mock.patch.object(
+            FileHunk, "data", side_effect=AssertionError
+        ), mock.patch.object(FileHunk, "chunks", side_effect=AssertionError):
+            bundle.build()
+        self.assertEqual(self.helper.get("out"), "VAR A = 1;\nVAR B = 2;")
+        self.assertEqual(received, [bytes])
+
+        del received[:]
+        bundle = self.mkbundle("a.js", filters=[Upper(), Reverse()], output="out2")
+        bundle.build()
+        self.assertEqual(self.helper.get("out2"), ";1 = A RAV")
+        self.assertEqual(received, [bytes, str])
+
+
+class TestFetch(VendorTestCase):
+    """remote sources are fetched concurrently, cached and mirrored"""
+
+    def setUp(self):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        super().setUp()
+        self.requests = []
+        # both files must be requested before either is served
+        barrier = threading.Barrier(2, timeout=5)
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                test.requests.append((self.path, self.headers.get("If-None-Match")))
+                if self.path == "/fresh.js":
+                    barrier.wait()
+                    self.respond(200, b"fresh", ("Cache-Control", "max-age=3600"))
+                elif self.headers.get("If-None-Match") == '"v1"':
+                    self.respond(304, b"")
+                else:
+                    barrier.wait()
+                    self.respond(200, b"etag", ("ETag", '"v1"'))
+
+            def respond(self, status, body, *headers):
+                self.send_response(status)
+                for header in headers:
+                    self.send_header(*header)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        base = "http://127.0.0.1:%d/" % self.server.server_address[1]
+        self.urls = (base + "fresh.js", base + "etag.js")
+
+    def test_fetch(self):
+        from pelican.plugins.webassets.vendor.webassets.fetch import pool
+
+        self.addCleanup(pool.close)
+        self.env.cache = "memory"
+        self.env.url_mirror = self.helper.path("mirror")
+        bundle = self.mkbundle(*self.urls, output="out")
+        bundle.build()
+        self.assertEqual(self.helper.get("out"), "fresh\netag")
+
+        # the fresh file is not requested again, the other one revalidated
+        bundle.build(force=True)
+        self.assertEqual(self.helper.get("out"), "fresh\netag")
+        self.assertEqual(
+            sorted(self.requests, key=str),
+            [("/etag.js", '"v1"'), ("/etag.js", None), ("/fresh.js", None)],
+        )
+
+        # without the network or a cache, the mirror is used
+        self.server.shutdown()
+        self.server.server_close()
+        pool.close()
+        self.env.cache = False
+        bundle.build(force=True)
+        self.assertEqual(self.helper.get("out"), "fresh\netag")
+
+    def test_freshness_expiry(self):
+        from pelican.plugins.webassets.vendor.webassets.fetch import freshness_expiry
+
+        self.assertEqual(freshness_expiry({"Cache-Control": "max-age=60"}, 100), 160)
+        self.assertEqual(
+            freshness_expiry({"Cache-Control": "public, max-age=60", "Age": "10"}, 0),
+            50,
+        )
+        self.assertIsNone(freshness_expiry({"Cache-Control": "no-cache"}, 0))
+        headers = {
+            "Date": "Mon, 01 Jan 2024 00:00:00 GMT",
+            "Expires": "Mon, 01 Jan 2024 01:00:00 GMT",
+        }
+        self.assertEqual(freshness_expiry(headers, 0), 3600)
+        self.assertIsNone(freshness_expiry({}, 0))
+
+
+class TestLazyFilterRegistry(unittest.TestCase):
+    """filter modules are only imported when needed"""
+
+    def test_builtin_filters_table(self):
+        from pelican.plugins.webassets.vendor.webassets import filter
+
+        filter.load_builtin_filters()
+        for name, module in filter.BUILTIN_FILTERS.items():
+            self.assertEqual(
+                filter._FILTERS[name].__module__.split(".")[-1],
+                module.split(".")[-1],
+            )
+        self.assertEqual(
+            set(filter.BUILTIN_FILTERS),
+            {n for n, f in filter._FILTERS.items() if f.__module__.startswith(filter.__name__)},
+        )
+
+    def test_import_time(self):
+        import subprocess
+        import sys
+
+        script = "\n".join(
+            [
+                "import sys, time",
+                "t0 = time.perf_counter()",
+                "from pelican.plugins.webassets import webassets",
+                "t1 = time.perf_counter()",
+                "from pelican.plugins.webassets.vendor.webassets import filter",
+                "lazy = [m for m in sys.modules if m.startswith(filter.__name__ + '.')]",
+                "filter.get_filter('cssmin')",
+                "loaded = [m for m in sys.modules if m.startswith(filter.__name__ + '.')]",
+                "t2 = time.perf_counter()",
+                "filter.load_builtin_filters()",
+                "t3 = time.perf_counter()",
+                "eager = [m for m in sys.modules if m.startswith(filter.__name__ + '.')]",
+                "print(len(lazy), len(loaded), len(eager), t1 - t0, t3 - t2)",
+            ]
+        )
+        output = subprocess.check_output(
+            [sys.executable, "-W", "ignore", "-c", script], text=True
+        )
+        lazy, loaded, eager, import_time, eager_time = output.split()
+        self.assertEqual((int(lazy), int(loaded)), (0, 1))
+        self.assertGreater(int(eager), int(loaded))
+        # Generous bounds, these only catch gross regressions.
+        self.assertLess(float(import_time), 5.0)
+        self.assertGreater(float(eager_time), 0)
+
+
+WORKER_SCRIPT = """
+import json, os, sys, time
+
+log = sys.argv[1]
+while True:
+    line = sys.stdin.buffer.readline()
+    if not line:
+        break
+    request = json.loads(line)
+    data = sys.stdin.buffer.read(request["size"])
+    if data == b"crash":
+        sys.stderr.write("crashing on purpose\\n")
+        sys.exit(1)
+    if data == b"hang":
+        sys.stderr.write("hanging on purpose\\n")
+        sys.stderr.flush()
+        time.sleep(60)
+    with open(log, "a") as f:
+        f.write("%d\\n" % os.getpid())
+    output = data.upper()
+    sys.stdout.buffer.write(
+        json.dumps({"returncode": 0, "size": len(output)}).encode() + b"\\n" + output
+    )
+    sys.stdout.buffer.flush()
+"""
+
+
+POSTCSS_MODULE = """
+module.exports = (plugins) => ({
+  process: (css, options) => Promise.resolve({
+    css: plugins.reduce((css, plugin) => plugin(css), css),
+  }),
+});
+"""
+
+
+class TestResolverIndex(VendorTestCase):
+    """the resolver answers lookups from cached directory listings"""
+
+    default_files = {"a/x.js": "X", "a/y.js": "Y", "a/.hidden.js": "H", "b/x.js": "X2"}
+
+    def setUp(self):
+        super().setUp()
+        self.env.append_path(self.helper.path("a"), "/a")
+        self.env.append_path(self.helper.path("b"), "/b")
+        self.resolver = self.env.resolver
+
+    def resolve(self, item):
+        return self.resolver.resolve_source(self.env, item)
+
+    def test_load_path(self):
+        self.assertEqual(self.resolve("x.js"), [self.helper.path("a/x.js")])
+        self.assertEqual(
+            self.resolve("*.js"),
+            [
+                self.helper.path("a/x.js"),
+                self.helper.path("a/y.js"),
+                self.helper.path("b/x.js"),
+            ],
+        )
+        self.assertRaises(IOError, self.resolve, "z.js")
+
+    def test_listing_validated(self):
+        index = self.resolver.index
+        index.racy_window = -1
+        self.resolve("x.js")
+        self.resolve("y.js")
+        self.assertEqual(index.hits, 1)
+
+        # adding a file changes the directory's modification time
+        mtime = os.stat(self.helper.path("b")).st_mtime_ns
+        self.helper.create_files({"b/z.js": "Z"})
+        os.utime(self.helper.path("b"), ns=(mtime + 10**9, mtime + 10**9))
+        self.assertEqual(self.resolve("z.js"), [self.helper.path("b/z.js")])
+
+    def test_url_mapping(self):
+        query = self.resolver.query_url_mapping
+        self.env.url_mapping[self.helper.path("a/sub")] = "/deep"
+        self.assertEqual(query(self.env, self.helper.path("a/x.js")), "/a/x.js")
+        self.assertEqual(query(self.env, self.helper.path("a/sub/c/d.js")), "/deep/c/d.js")
+        self.assertEqual(query(self.env, self.helper.path("b")), "/b/")
+        self.assertEqual(query(self.env, self.helper.path("c.js")), "/c.js")
+        # only whole path components match
+        self.assertEqual(query(self.env, self.helper.path("ab/x.js")), "/ab/x.js")
+
+        # the trie is rebuilt when the configuration changes
+        self.env.url_mapping[self.helper.path("ab")] = "/other"
+        self.assertEqual(query(self.env, self.helper.path("ab/x.js")), "/other/x.js")
+
+    def test_recursive_glob(self):
+        self.helper.create_files({"a/sub/z.js": "Z"})
+        # ** also matches no directory at all, like with glob2
+        self.assertEqual(
+            self.resolve("**/*.js"),
+            [
+                self.helper.path("a/sub/z.js"),
+                self.helper.path("a/x.js"),
+                self.helper.path("a/y.js"),
+                self.helper.path("b/x.js"),
+            ],
+        )
+
+    def test_relative_paths(self):
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(self.helper.tempdir)
+        self.env.url_mapping[os.path.join("a", "sub")] = "/rel"
+        query = self.resolver.query_url_mapping
+        self.assertEqual(query(self.env, self.helper.path("a/sub/x.js")), "/rel/x.js")
+        self.assertEqual(self.resolver.index.find("a", "x.js"), os.path.join("a", "x.js"))
+
+        # the same relative paths, from elsewhere, name other directories
+        os.chdir(self.helper.path("b"))
+        self.assertEqual(query(self.env, self.helper.path("a/sub/x.js")), "/a/sub/x.js")
+        self.assertIsNone(self.resolver.index.find("a", "x.js"))
+
+
+class TestProfile(VendorTestCase):
+    """builds can be timed, span by span"""
+
+    default_files = {"in1": "A", "in2": "B"}
+
+    def test_disabled(self):
+        from pelican.plugins.webassets.vendor.webassets.instrument import active
+
+        self.assertFalse(self.env.profile.enabled)
+        self.mkbundle("in1", output="out").build()
+        self.assertFalse(active().enabled)
+
+    def test_build(self):
+        from pelican.plugins.webassets.vendor.webassets.instrument import active
+
+        self.env.cache = "memory"
+        self.env.profile = True
+        profiler = self.env.profile
+        self.assertIs(self.env.profile, profiler)
+
+        self.mkbundle("in1", "in2", filters="cssrewrite", output="out").build(
+            force=True
+        )
+        totals = profiler.totals()
+        self.assertEqual(totals[("bundle", "out")][0], 1)
+        self.assertEqual(totals[("source", "in1")][0], 1)
+        self.assertEqual(totals[("filter", "cssrewrite.input")][0], 2)
+        self.assertIn(("cache", "get"), totals)
+        self.assertEqual(profiler.counters["cache.misses"], 2)
+        self.assertFalse(active().enabled)
+
+        # the second build is served from the cache
+        self.mkbundle("in1", "in2", filters="cssrewrite", output="out").build(
+            force=True
+        )
+        self.assertEqual(profiler.counters["cache.hits"], 2)
+        self.assertIn("filter: cssrewrite.input", profiler.summary())
+
+        events = profiler.chrome_trace()["traceEvents"]
+        self.assertEqual({e["ph"] for e in events}, {"X", "C"})
+        self.assertIn("bundle", {e.get("cat") for e in events})
+
+    def test_build_command(self):
+        import json
+
+        from pelican.plugins.webassets.vendor.webassets.script import (
+            CommandLineEnvironment,
+        )
+
+        self.env.register("b", self.mkbundle("in1", output="out"))
+        trace = self.helper.path("trace.json")
+        command = CommandLineEnvironment(self.env, logging.getLogger("test"))
+        command.build(profile=True, trace=trace)
+        with open(trace) as f:
+            events = json.load(f)["traceEvents"]
+        self.assertIn("out", {e["name"] for e in events})
+
+
+class TestFileManifest(VendorTestCase):
+    """manifest writes are batched and atomic, reads only follow changes"""
+
+    def test_batch(self):
+        from types import SimpleNamespace
+        from unittest import mock
+
+        from pelican.plugins.webassets.vendor.webassets.version import JsonManifest
+
+        filename = self.helper.path("manifest.json")
+        manifest = JsonManifest(filename)
+        ctx = SimpleNamespace(auto_build=True)
+        with manifest.batch():
+            manifest.remember(SimpleNamespace(output="a.css"), ctx, "1")
+            manifest.remember(SimpleNamespace(output="b.css"), ctx, "2")
+            self.assertFalse(os.path.exists(filename))
+            self.assertEqual(manifest.query(SimpleNamespace(output="a.css"), ctx), "1")
+        self.assertEqual(self.helper.get("manifest.json").count('"'), 8)
+        self.assertEqual(
+            sorted(os.listdir(self.helper.tempdir)), ["manifest.json", "manifest.json.lock"]
+        )
+
+        # without a batch, a new version is written right away, an
+        # unchanged one not at all
+        with mock.patch.object(manifest, "_save_manifest", wraps=manifest._save_manifest) as save:
+            manifest.remember(SimpleNamespace(output="a.css"), ctx, "1")
+            manifest.remember(SimpleNamespace(output="a.css"), ctx, "3")
+        self.assertEqual(save.call_count, 1)
+
+        # the file is only parsed again once it changed
+        other = JsonManifest(filename)
+        with mock.patch.object(other, "_read", wraps=other._read) as read:
+            self.assertEqual(other.query(SimpleNamespace(output="a.css"), ctx), "3")
+            self.assertEqual(read.call_count, 0)
+            manifest.remember(SimpleNamespace(output="c.css"), ctx, "4")
+            self.assertEqual(other.query(SimpleNamespace(output="c.css"), ctx), "4")
+            self.assertEqual(read.call_count, 1)
+
+        # versions written by another instance in the meantime are kept
+        with other.batch():
+            other.remember(SimpleNamespace(output="d.css"), ctx, "5")
+            manifest.remember(SimpleNamespace(output="e.css"), ctx, "6")
+        self.assertEqual(
+            JsonManifest(filename).manifest,
+            {"a.css": "3", "b.css": "2", "c.css": "4", "d.css": "5", "e.css": "6"},
+        )
+
+    def test_flush_locked(self):
+        import threading
+        from types import SimpleNamespace
+
+        from pelican.plugins.webassets.vendor.webassets.version import JsonManifest, _file_lock
+
+        filename = self.helper.path("manifest.json")
+        manifest = JsonManifest(filename)
+        ctx = SimpleNamespace(auto_build=False)
+        writer = threading.Thread(
+            target=manifest.remember, args=(SimpleNamespace(output="a.css"), ctx, "1")
+        )
+        # another process is writing the manifest
+        with _file_lock(filename + ".lock"):
+            writer.start()
+            writer.join(0.2)
+            self.assertTrue(writer.is_alive())
+            self.assertFalse(os.path.exists(filename))
+        writer.join()
+        self.assertEqual(JsonManifest(filename).manifest, {"a.css": "1"})
+
+    def test_flush_locked_windows(self):
+        import errno
+        import sys
+        from types import SimpleNamespace
+        from unittest import mock
+
+        from pelican.plugins.webassets.vendor.webassets.version import _file_lock
+
+        msvcrt = SimpleNamespace(LK_LOCK=1, LK_UNLCK=0, locking=mock.Mock())
+        filename = self.helper.path("manifest.lock")
+        with mock.patch.dict(sys.modules, msvcrt=msvcrt), mock.patch("os.name", "nt"):
+            # the lock is given up on after a number of attempts
+            msvcrt.locking.side_effect = OSError(errno.EDEADLK, "deadlock")
+            with self.assertRaises(OSError), _file_lock(filename, attempts=3):
+                pass
+            self.assertEqual(msvcrt.locking.call_count, 3)
+
+            # other errors are not retried
+            msvcrt.locking.reset_mock()
+            msvcrt.locking.side_effect = OSError(errno.EBADF, "bad file")
+            with self.assertRaises(OSError), _file_lock(filename):
+                pass
+            self.assertEqual(msvcrt.locking.call_count, 1)
+
+            msvcrt.locking.reset_mock()
+            msvcrt.locking.side_effect = [OSError(errno.EACCES, "locked"), None, None]
+            with _file_lock(filename):
+                pass
+            self.assertEqual(msvcrt.locking.call_args[0][1:], (0, 1))
+
+    def test_sri(self):
+        from types import SimpleNamespace
+
+        from pelican.plugins.webassets.vendor.webassets.version import (
+            FileManifest,
+            JsonManifest,
+        )
+
+        ctx = SimpleNamespace(auto_build=False)
+        bundle = SimpleNamespace(output="a.css")
+        for cls in (FileManifest, JsonManifest):
+            filename = self.helper.path("manifest-%s" % cls.id)
+            manifest = cls(filename)
+            with manifest.batch():
+                manifest.remember(bundle, ctx, "1")
+                manifest.remember_sri(bundle, ctx, "sha384-x")
+
+            # the hash is read back by a new process, with the version,
+            # from a file of its own
+            other = cls(filename)
+            self.assertEqual(other.manifest, {"a.css": "1"})
+            self.assertEqual(other.query_sri(bundle, ctx), "sha384-x")
+            self.assertEqual(cls(filename)._load_file(filename)[0], {"a.css": "1"})
+            self.assertTrue(os.path.exists(filename + ".sri"))
+
+            # but not once the version changed
+            manifest.remember(bundle, ctx, "2")
+            self.assertIsNone(cls(filename).query_sri(bundle, ctx))
+
+    def test_sri_in_cache(self):
+        from pelican.plugins.webassets.vendor.webassets.version import CacheManifest
+
+        self.env.cache = "memory"
+        bundle = self.mkbundle("in", output="a.css")
+        manifest = CacheManifest()
+        manifest.remember(bundle, self.env, "1")
+        manifest.remember_sri(bundle, self.env, "sha384-x")
+        self.assertEqual(manifest.query_sri(bundle, self.env), "sha384-x")
+        manifest.remember(bundle, self.env, "2")
+        self.assertIsNone(manifest.query_sri(bundle, self.env))
+
+
+class TestResolvedContext(VendorTestCase):
+    """contexts keep the settings they looked up until the config changes"""
+
+    default_files = {"a.css": "a {}", "b.css": "b {}"}
+
+    def test_reuse(self):
+        from pelican.plugins.webassets.vendor.webassets.bundle import wrap
+
+        nested = self.mkbundle("b.css", debug="merge")
+        bundle = self.mkbundle("a.css", nested, output="out.css")
+        bundle.build()
+        version = self.env.config.version
+        bundle.build(force=True)
+        # resolving settings does not count as a change
+        self.assertEqual(self.env.config.version, version)
+
+        ctx = wrap(self.env, bundle)
+        self.assertIs(wrap(self.env, bundle), ctx)
+        child = wrap(ctx, nested)
+        self.assertIs(wrap(ctx, nested), child)
+        self.assertIs(child.cache, self.env.cache)
+        self.assertIs(object.__getattribute__(child, "cache"), self.env.cache)
+        self.assertEqual(child.debug, "merge")
+        self.assertIs(child.environment, self.env)
+
+        self.env.debug = True
+        new_ctx = wrap(self.env, bundle)
+        self.assertIsNot(new_ctx, ctx)
+        self.assertIs(new_ctx.debug, True)
+        self.assertEqual(wrap(new_ctx, nested).debug, "merge")
+
+        nested.config["debug"] = False
+        self.assertIs(wrap(new_ctx, nested).debug, False)
+
+    def test_untracked_storage(self):
+        from pelican.plugins.webassets.vendor.webassets.bundle import wrap
+
+        bundle = self.mkbundle("a.css", output="out.css")
+        bundle.config.version = None
+        ctx = wrap(self.env, bundle)
+        self.assertIsNot(wrap(self.env, bundle), ctx)
+        self.assertEqual(ctx.debug, False)
+        with self.assertRaises(AttributeError):
+            object.__getattribute__(ctx, "debug")
+
+
+class TestConcatSafeOutput(VendorTestCase):
+    """concatenation-safe output filters run, and are cached, per source"""
+
+    default_files = {"a.js": "var a  =  1;", "b.js": "var b  =  2;", "c.js": "var c  =  3;"}
+
+    def test_per_source(self):
+        from pelican.plugins.webassets.vendor.webassets.filter import Filter
+
+        seen = []
+
+        class Squeeze(Filter):
+            concat_safe = True
+
+            def output(self, _in, out, **kw):
+                data = _in.read()
+                seen.append(data)
+                out.write(data.replace("  ", ""))
+
+        class Wrap(Filter):
+            def output(self, _in, out, **kw):
+                out.write("(%s)" % _in.read())
+
+        self.env.cache = True
+        self.mkbundle("a.js", "b.js", filters=[Squeeze(), Wrap()], output="out.js").build()
+        self.assertEqual(self.helper.get("out.js"), "(var a=1;\nvar b=2;)")
+        self.assertEqual(seen, ["var a  =  1;", "var b  =  2;"])
+
+        # only the changed file is filtered again
+        del seen[:]
+        self.helper.create_files({"b.js": "var b  =  4;"})
+        self.mkbundle("a.js", "b.js", filters=[Squeeze(), Wrap()], output="out.js").build(
+            force=True
+        )
+        self.assertEqual(self.helper.get("out.js"), "(var a=1;\nvar b=4;)")
+        self.assertEqual(seen, ["var b  =  4;"])
+
+        # a filter which is not concatenation-safe sees the merged content
+        del seen[:]
+        self.mkbundle("a.js", "c.js", filters=[Wrap(), Squeeze()], output="out2.js").build()
+        self.assertEqual(self.helper.get("out2.js"), "(var a=1;\nvar c=3;)")
+        self.assertEqual(seen, ["(var a  =  1;\nvar c  =  3;)"])
+
+        # without a cache to reuse the results, the sources are not split
+        del seen[:]
+        self.env.cache = False
+        self.mkbundle("a.js", "c.js", filters=[Squeeze(), Wrap()], output="out3.js").build()
+        self.assertEqual(self.helper.get("out3.js"), "(var a=1;\nvar c=3;)")
+        self.assertEqual(seen, ["var a  =  1;\nvar c  =  3;"])
+
+    def test_builtin_filters(self):
+        from pelican.plugins.webassets.vendor.webassets import filter
+
+        sources = {
+            "js": ["var a = 1", "x\n++y", "/*! keep */\nvar c = /x+/g;", "'use strict';\nd()"],
+            "css": ['b { x: y }', '@charset "utf-8";\na { color : red ; }', "/*! keep */\nd { }"],
+        }
+        for kind, contents in sources.items():
+            self.helper.create_files({"%d.%s" % (i, kind): c for i, c in enumerate(contents)})
+
+        self.env.cache = "memory"
+        for name in sorted(filter.BUILTIN_FILTERS):
+            if not filter.get_filter(name).concat_safe:
+                continue
+            with self.subTest(filter=name):
+                kind = "css" if "css" in name else "js"
+                instance = filter.get_filter(name)
+                try:
+                    instance.set_context(self.env.config)
+                    instance.setup()
+                except (EnvironmentError, ImportError):
+                    self.skipTest("%s is not available" % name)
+                files = ["%d.%s" % (i, kind) for i in range(len(sources[kind]))]
+                self.mkbundle(*files, filters=instance, output="per-source").build()
+                instance.concat_safe = False
+                self.mkbundle(*files, filters=instance, output="merged").build()
+                per_source, merged = self.helper.get("per-source"), self.helper.get("merged")
+
+                # only the line breaks between the sources may differ, and
+                # are removed when the output is filtered once more
+                self.assertEqual(per_source.replace("\n", ""), merged.replace("\n", ""))
+                self.mkbundle("per-source", filters=instance, output="again").build()
+                self.assertEqual(self.helper.get("again"), merged)
+
+
+class TestFinalize(VendorTestCase):
+    """the output is hashed and compressed while it is written"""
+
+    default_files = {"in1": "A", "in2": "B"}
+
+    def test_version_and_sri(self):
+        import base64
+        import gzip
+
+        from pelican.plugins.webassets.vendor.webassets.utils import calculate_sri
+
+        self.env.cache = "memory"
+        self.env.versions = "hash"
+        self.env.manifest = "cache"
+        self.env.precompress = True
+        bundle = self.mkbundle("in1", "in2", output="out.%(version)s")
+        bundle.build()
+
+        expected = hashlib.md5(b"A\nB").hexdigest()[:8]
+        self.assertEqual(bundle.version, expected)
+        self.assertEqual(self.helper.get("out.%s" % expected), "A\nB")
+        with gzip.open(self.helper.path("out.%s.gz" % expected)) as f:
+            self.assertEqual(f.read(), b"A\nB")
+        # no temporary files are left behind
+        self.assertEqual(
+            sorted(os.listdir(self.helper.tempdir)),
+            ["in1", "in2", "out.%s" % expected, "out.%s.gz" % expected],
+        )
+
+        sri = calculate_sri(b"A\nB")
+        self.assertEqual(self.env.manifest.query_sri(bundle, self.env), sri)
+        # the file is not read again to get the hash
+        os.unlink(self.helper.path("out.%s" % expected))
+        self.assertEqual(bundle.urls(calculate_sri=True)[0]["sri"], sri)
+        self.assertTrue(base64.b64decode(sri[len("sha384-"):]))
+
+    def test_precompress_option(self):
+        self.assertEqual(self.env.precompress, ())
+        self.env.precompress = "gz, br"
+        self.assertEqual(self.env.precompress, ("gz", "br"))
+        self.env.precompress = ["zip"]
+        self.assertRaises(ValueError, lambda: self.env.precompress)
+
+
+class TestExternalToolWorker(VendorTestCase):
+    """external tools can be run as persistent workers"""
+
+    default_files = {"in1": "a", "in2": "b", "in3": "crash", "in4": "hang"}
+
+    def test_worker(self):
+        import sys
+        import warnings
+
+        from pelican.plugins.webassets.vendor.webassets.exceptions import BuildError
+        from pelican.plugins.webassets.vendor.webassets.filter import ExternalTool
+
+        self.helper.create_files({"worker.py": WORKER_SCRIPT})
+        log = self.helper.path("worker.log")
+        upper = "import sys; sys.stdout.write(sys.stdin.read().upper())"
+
+        class Upper(ExternalTool):
+            name = "upper_worker"
+            worker_argv = [sys.executable, self.helper.path("worker.py"), log]
+
+            def input(self, _in, out, **kw):
+                self.subprocess([sys.executable, "-c", upper], out, _in)
+
+        self.env.cache = False
+        bundle = self.mkbundle("in1", "in2", filters=Upper(), output="out")
+        bundle.build()
+        self.assertEqual(self.helper.get("out"), "A\nB")
+        with open(log) as f:
+            pids = f.read().split()
+        self.assertEqual(len(pids), 2)
+        self.assertEqual(len(set(pids)), 1)
+
+        # a crashing worker is replaced, the request run once-off instead
+        bundle = self.mkbundle("in3", "in1", filters=Upper(), output="out2")
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            bundle.build()
+        self.assertEqual(self.helper.get("out2"), "CRASH\nA")
+        self.assertEqual(len(caught), 1)
+        self.assertIn("crashing on purpose", str(caught[0].message))
+
+        # a worker which does not answer is killed, and the build fails
+        Upper.worker_timeout = 0.5
+        bundle = self.mkbundle("in4", filters=Upper(), output="out3")
+        with self.assertRaises(BuildError) as raised:
+            bundle.build()
+        self.assertIn("hanging on purpose", str(raised.exception))
+        # the next request is answered by a new worker
+        bundle = self.mkbundle("in1", filters=Upper(), output="out4")
+        bundle.build()
+        self.assertEqual(self.helper.get("out4"), "A")
+
+    @unittest.skipIf(not which("node"), "node not installed")
+    def test_postcss_worker(self):
+        from pelican.plugins.webassets.vendor.webassets.filter import get_filter
+
+        # a stand-in for the postcss module, and a plugin
+        self.helper.create_files(
+            {
+                "node_modules/postcss/index.js": POSTCSS_MODULE,
+                "node_modules/upper/index.js": (
+                    "module.exports = (css) => css.toUpperCase();"
+                ),
+                "node_modules/log/index.js": (
+                    "module.exports = () => (css) => css + process.pid;"
+                ),
+            }
+        )
+        self.env.config["POSTCSS_WORKER"] = True
+        self.env.config["POSTCSS_EXTRA_ARGS"] = ["--use", "upper"]
+        postcss = get_filter("postcss")
+        self.env.cache = False
+        self.mkbundle("in1", "in2", filters=postcss, output="out").build()
+        self.assertEqual(self.helper.get("out"), "A\nB")
+
+        # plugins from the config file, loaded by the same process
+        self.helper.create_files(
+            {"postcss.config.js": "module.exports = {plugins: {log: true}};"}
+        )
+        self.env.config["POSTCSS_EXTRA_ARGS"] = None
+        postcss = get_filter("postcss")
+        self.mkbundle("in1", "in2", filters=postcss, output="out2").build()
+        a, b = self.helper.get("out2").split("\n")
+        self.assertEqual(a[1:], b[1:])
+
+
+class TestBuildStateSnapshot(VendorTestCase):
+    """up to date checks compare against the state of the last build"""
+
+    default_files = {"in1": "A", "in2": "B"}
+
+    def setUp(self):
+        super().setUp()
+        self.env.cache = "memory"
+        self.env.versions = False
+        self.bundle = self.mkbundle("in*", output="out")
+        self.bundle.build()
+        self.updater = self.env.updater
+
+    def change(self, name, content):
+        # keeps the modification time, so only the size gives it away
+        mtime = os.stat(self.helper.path(name)).st_mtime_ns
+        self.helper.create_files({name: content})
+        os.utime(self.helper.path(name), ns=(mtime, mtime))
+
+    def test_snapshot(self):
+        snapshot = self.updater.get_snapshot(self.bundle, self.env)
+        self.assertEqual(
+            [f for f, _, _ in snapshot["files"]],
+            [self.helper.path(n) for n in ("out", "in1", "in2")],
+        )
+        self.assertFalse(self.updater.needs_rebuild(self.bundle, self.env))
+
+        # an equal bundle uses the same snapshot; a different one does not
+        same = self.mkbundle("in*", output="out")
+        self.assertFalse(self.updater.needs_rebuild(same, self.env))
+        other = self.mkbundle("in1", output="out")
+        self.assertTrue(self.updater.needs_rebuild(other, self.env))
+
+        # it is kept in the cache, for the next process
+        from pelican.plugins.webassets.vendor.webassets.updater import (
+            TimestampUpdater,
+        )
+
+        self.assertFalse(TimestampUpdater().needs_rebuild(self.bundle, self.env))
+
+        self.change("in2", "BB")
+        self.assertTrue(self.updater.needs_rebuild(self.bundle, self.env))
+
+    def test_bundle_changed(self):
+        # the same instance, with the same files in another order
+        self.bundle.contents = ("in2", "in1")
+        self.assertTrue(self.updater.needs_rebuild(self.bundle, self.env))
+
+    def test_new_file_matching_glob(self):
+        self.helper.create_files({"in3": "C"})
+        self.assertTrue(self.updater.needs_rebuild(self.bundle, self.env))
+
+    def test_freshness(self):
+        self.env.updater_freshness = True
+        self.assertFalse(self.updater.needs_rebuild(self.bundle, self.env))
+
+        # within the window, the files are not looked at
+        self.change("in1", "AA")
+        self.assertFalse(self.updater.needs_rebuild(self.bundle, self.env))
+        self.updater.invalidate()
+        self.assertTrue(self.updater.needs_rebuild(self.bundle, self.env))
+
+        self.bundle.build()
+        self.assertEqual(self.helper.get("out"), "AA\nB")
+        self.assertFalse(self.updater.needs_rebuild(self.bundle, self.env))
+
+    def test_stream_output(self):
+        import io
+
+        # the output file is not written, so it is still out of date
+        self.helper.create_files({"in1": "AA"})
+        mtime = os.stat(self.helper.path("out")).st_mtime_ns + 2 * 10**9
+        os.utime(self.helper.path("in1"), ns=(mtime, mtime))
+        self.bundle.build(force=True, output=io.StringIO())
+        self.assertTrue(self.updater.needs_rebuild(self.bundle, self.env))
+
+
 class TestDeprecationDate(unittest.TestCase):
     """Is it time to remove the deprecation warnings?"""
 